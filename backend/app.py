@@ -1,6 +1,9 @@
+import math
 import os
 from datetime import datetime, timezone
-from flask import Flask, request, jsonify, send_from_directory
+
+import orjson
+from flask import Flask, request, send_from_directory
 
 from .db import query_closest_departures, get_trip_details
 
@@ -11,6 +14,17 @@ app = Flask(
     static_url_path=""
 )
 
+# Largest number of departures one request may ask for
+MAX_LIMIT = 100
+# Larger search radii are reduced to this, the widest the frontend offers
+MAX_RADIUS_M = 5000.0
+
+
+def _json_response(payload):
+    # orjson encodes several times faster than the stdlib json behind flask.jsonify
+    return app.response_class(orjson.dumps(payload), mimetype="application/json")
+
+
 @app.route("/")
 def index():
     # Serve frontend/index.html
@@ -22,20 +36,24 @@ def _parse_coordinates(value: str):
         return None
     try:
         lat_s, lon_s = value.split(",")
-        return float(lat_s.strip()), float(lon_s.strip())
+        lat, lon = float(lat_s.strip()), float(lon_s.strip())
     except Exception:
         return None
+    # float() accepts "nan" and "inf", which no stop lookup can work with
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    return lat, lon
 
 
 @app.route("/health")
 def health():
-    return jsonify({"status": "ok"})
+    return _json_response({"status": "ok"})
 
 
 @app.route("/public_transport/city/<city>/closest_departures")
 def closest_departures(city):
     if city.lower() != "wroclaw":
-        return jsonify({"error": "City not supported"}), 404
+        return _json_response({"error": "City not supported"}), 404
 
     start_coordinates = request.args.get("start_coordinates")
     end_coordinates = request.args.get("end_coordinates")
@@ -48,7 +66,7 @@ def closest_departures(city):
 
     if not start or not end:
         return (
-            jsonify(
+            _json_response(
                 {
                     "error": "start_coordinates and end_coordinates are required in 'lat,lon' format",
                     "example": "51.1079,17.0385",
@@ -60,15 +78,21 @@ def closest_departures(city):
     try:
         limit = int(limit)
     except ValueError:
-        return jsonify({"error": "limit must be an integer"}), 400
+        return _json_response({"error": "limit must be an integer"}), 400
+    if not 1 <= limit <= MAX_LIMIT:
+        return _json_response({"error": f"limit must be between 1 and {MAX_LIMIT}"}), 400
 
     try:
         radius_m = float(radius_m)
     except ValueError:
-        return jsonify({"error": "radius_m must be a number (meters)"}), 400
+        return _json_response({"error": "radius_m must be a number (meters)"}), 400
+    if not math.isfinite(radius_m):
+        return _json_response({"error": "radius_m must be a number (meters)"}), 400
+    radius_m = min(radius_m, MAX_RADIUS_M)
 
     if start_time is None:
-        start_time = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+        # Whole seconds are all the query uses; one strftime instead of isoformat() + replace()
+        start_time = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
     departures = query_closest_departures(city, start, end, start_time, limit, radius_m)
 
@@ -84,17 +108,17 @@ def closest_departures(city):
         },
     }
 
-    return jsonify({"metadata": metadata, "departures": departures})
+    return _json_response({"metadata": metadata, "departures": departures})
 
 
 @app.route("/public_transport/city/<city>/trip/<trip_id>")
 def trip_details(city, trip_id):
     if city.lower() != "wroclaw":
-        return jsonify({"error": "City not supported"}), 404
+        return _json_response({"error": "City not supported"}), 404
 
     details = get_trip_details(city, trip_id)
     if details is None:
-        return jsonify({"error": "Trip not found"}), 404
+        return _json_response({"error": "Trip not found"}), 404
 
     metadata = {
         "self": request.path,
@@ -104,7 +128,7 @@ def trip_details(city, trip_id):
         },
     }
 
-    return jsonify({"metadata": metadata, "trip_details": details})
+    return _json_response({"metadata": metadata, "trip_details": details})
 
 
 if __name__ == "__main__":
@@ -1,77 +1,357 @@
+import functools
+import math
 import os
 import sqlite3
-from typing import List, Tuple, Dict, Any, Optional
+import threading
+from typing import List, Tuple, Dict, Any, Optional, NamedTuple
 
-from .utils import haversine_distance_m, extract_time_part_iso, combine_date_and_hms
+import numpy as np
+
+from .utils import (
+    EARTH_RADIUS_M,
+    haversine_distance_m_batch_rad,
+    bounding_box,
+    parse_iso_datetime,
+    combine_day_and_seconds,
+)
 
 # Path can be overridden via environment variable, to make tests easier
 DEFAULT_DB_PATH = os.environ.get("GTFS_DB_PATH") or os.path.join(os.path.dirname(__file__), "..", "data", "gtfs.sqlite")
 
 
+# One connection per thread and database file; GTFS data is read-only, so they are only replaced
+# when the caches are cleared
+_tls = threading.local()
+
+# Bumped by clear_caches(); each thread reopens its connections when it sees a new value
+_cache_generation = 0
+
+# File identity of each database as of its cached data, see _db_version()
+_db_versions: Dict[str, Optional[Tuple[int, int, int]]] = {}
+_db_versions_lock = threading.Lock()
+
+
+def _resolve_db_path(db_path: Optional[str] = None) -> str:
+    return db_path or os.environ.get("GTFS_DB_PATH") or DEFAULT_DB_PATH
+
+
+def _db_version(db_path: str) -> Optional[Tuple[int, int, int]]:
+    """(inode, mtime_ns, size) of a database file, None for URIs and in-memory databases."""
+    try:
+        st = os.stat(db_path)
+    except (OSError, ValueError):
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _current_db_path(db_path: Optional[str] = None) -> str:
+    """Resolve the database path, dropping the cached data first if the file was replaced or rewritten."""
+    db_path = _resolve_db_path(db_path)
+    version = _db_version(db_path)
+    with _db_versions_lock:
+        seen = _db_versions.setdefault(db_path, version)
+        if seen != version:
+            # E.g. the importer was re-run under a live server: stale stops, trips and rowids
+            clear_caches()
+            _db_versions[db_path] = version
+    return db_path
+
+
+def clear_caches() -> None:
+    """Forget everything read from the databases, e.g. after re-importing GTFS data."""
+    global _cache_generation
+    for cached in (_load_stop_arrays, _load_trip_meta, _load_next_stop_index, _load_stop_grid,
+                   _closest_departures, _trip_details):
+        cached.cache_clear()
+    _cache_generation += 1
+
+
 def get_connection(db_path: Optional[str] = None) -> sqlite3.Connection:
-    conn = sqlite3.connect(db_path or DEFAULT_DB_PATH)
-    conn.row_factory = sqlite3.Row
+    db_path = _resolve_db_path(db_path)
+    connections = getattr(_tls, "connections", None)
+    if connections is None or _tls.generation != _cache_generation:
+        # Old connections are not closed here: a caller up the stack may still be reading from one
+        connections = _tls.connections = {}
+        _tls.generation = _cache_generation
+    conn = connections.get(db_path)
+    if conn is None:
+        # Plain tuple rows: callers unpack positionally, which is cheaper than sqlite3.Row lookups.
+        # uri=True also accepts "file:...?mode=memory&cache=shared" databases; plain paths are unaffected
+        conn = sqlite3.connect(db_path, uri=True)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.execute("PRAGMA cache_size=-65536")
+        # Sorts of the batched departure query stay in memory
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA query_only=1")
+        connections[db_path] = conn
     return conn
 
 
-def _fetch_candidate_stops(conn, start_lat: float, start_lon: float, radius_m: float):
-    cur = conn.cursor()
-    cur.execute("""SELECT stop_id, stop_name, stop_lat, stop_lon FROM stops""")
-    rows = cur.fetchall()
-    candidates = []
-    for row in rows:
+class StopArrays(NamedTuple):
+    """Stops table held as parallel arrays, ordered by rowid."""
+    rowids: np.ndarray
+    stop_ids: np.ndarray
+    names: np.ndarray
+    lats: np.ndarray
+    lons: np.ndarray
+    # Derived once at load time, so distance computations only do trig for the query point
+    lat_rad: np.ndarray
+    lon_rad: np.ndarray
+    cos_lat: np.ndarray
+
+
+@functools.lru_cache(maxsize=None)
+def _load_stop_arrays(db_path: str) -> StopArrays:
+    """Read the (static) stops table once per database file."""
+    cur = get_connection(db_path).cursor()
+    cur.execute("SELECT rowid, stop_id, stop_name, stop_lat, stop_lon FROM stops ORDER BY rowid")
+    rowids, stop_ids, names, lats, lons = [], [], [], [], []
+    for rowid, stop_id, stop_name, lat_s, lon_s in cur:
         try:
-            lat = float(row["stop_lat"])
-            lon = float(row["stop_lon"])
+            lat = float(lat_s)
+            lon = float(lon_s)
         except (TypeError, ValueError):
             continue
-        dist = haversine_distance_m(start_lat, start_lon, lat, lon)
-        if dist <= radius_m:
-            candidates.append({
-                "stop_id": row["stop_id"],
-                "name": row["stop_name"],
-                "latitude": lat,
-                "longitude": lon,
-                "distance_m": dist,
-            })
-    candidates.sort(key=lambda x: x["distance_m"])
-    return candidates
+        rowids.append(rowid)
+        stop_ids.append(stop_id)
+        names.append(stop_name)
+        lats.append(lat)
+        lons.append(lon)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    lat_rad = np.radians(lats)
+    return StopArrays(
+        rowids=np.asarray(rowids, dtype=np.int64),
+        stop_ids=np.asarray(stop_ids, dtype=object),
+        names=np.asarray(names, dtype=object),
+        lats=lats,
+        lons=lons,
+        lat_rad=lat_rad,
+        lon_rad=np.radians(lons),
+        cos_lat=np.cos(lat_rad),
+    )
 
 
-def _is_trip_towards_destination(conn, trip_id: str, current_stop_id: str, current_lat: float, current_lon: float,
-                                 dest_lat: float, dest_lon: float) -> bool:
+def _vector_equirect_sq(lat0: float, lon0: float, lat_rad: np.ndarray, lon_rad: np.ndarray) -> np.ndarray:
+    """Squared equirectangular angular distances (radians^2) from one point to arrays of nearby points.
+
+    The point is in degrees, the arrays in radians (StopArrays.lat_rad / lon_rad).
+
+    Radius filters compare these against (radius_m / EARTH_RADIUS_M) ** 2, so only the stops that pass
+    need their exact distance computed.
     """
-    Approximate direction check: if the next stop in the trip is closer to the destination
-    than the current stop, treat it as going in the right direction.
+    x = (lon_rad - math.radians(lon0)) * math.cos(math.radians(lat0))
+    y = lat_rad - math.radians(lat0)
+    return x * x + y * y
+
+
+@functools.lru_cache(maxsize=None)
+def _load_trip_meta(db_path: str) -> Dict[str, Tuple[str, str]]:
+    """Map trip_id -> (route_id, trip_headsign), read once per database file."""
+    cur = get_connection(db_path).cursor()
+    cur.execute("SELECT trip_id, route_id, trip_headsign FROM trips")
+    return {trip_id: (route_id, trip_headsign) for trip_id, route_id, trip_headsign in cur}
+
+
+@functools.lru_cache(maxsize=None)
+def _load_next_stop_index(db_path: str) -> np.ndarray:
+    """For every stop_times rowid, the StopArrays index of the trip's next stop (-1 if none).
+
+    Built once per database file from a single ordered scan, so the direction check of a departure
+    is an array lookup instead of SQL.
     """
-    cur = conn.cursor()
-    # Get sequence of current stop
-    cur.execute(
-        "SELECT stop_sequence FROM stop_times WHERE trip_id = ? AND stop_id = ? ORDER BY stop_sequence ASC LIMIT 1",
-        (trip_id, current_stop_id),
-    )
-    row = cur.fetchone()
-    if not row:
-        return True  # can't determine, don't filter out
-    seq = row["stop_sequence"]
+    stops = _load_stop_arrays(db_path)
+    stop_ix = {stop_id: i for i, stop_id in enumerate(stops.stop_ids)}
+    cur = get_connection(db_path).cursor()
+    cur.execute("SELECT max(rowid) FROM stop_times")
+    max_rowid = cur.fetchone()[0] or 0
+    next_stop = np.full(max_rowid + 1, -1, dtype=np.int32)
+
+    cur.execute("SELECT rowid, trip_id, stop_id FROM stop_times ORDER BY trip_id, stop_sequence")
+    prev_rowid, prev_trip_id = None, None
+    for rowid, trip_id, stop_id in cur:
+        if trip_id == prev_trip_id:
+            next_stop[prev_rowid] = stop_ix.get(stop_id, -1)
+        prev_rowid, prev_trip_id = rowid, trip_id
+    return next_stop
+
+
+# Size of the stop grid cells, in degrees of latitude and longitude (~1.1 x 0.7 km in Wroclaw)
+_GRID_CELL_DEG = 0.01
+
+
+def _grid_cell(lat: float, lon: float) -> Tuple[int, int]:
+    return math.floor(lat / _GRID_CELL_DEG), math.floor(lon / _GRID_CELL_DEG)
+
+
+@functools.lru_cache(maxsize=None)
+def _load_stop_grid(db_path: str) -> Dict[Tuple[int, int], np.ndarray]:
+    """StopArrays indices bucketed by _GRID_CELL_DEG grid cell, built once per database file."""
+    stops = _load_stop_arrays(db_path)
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    for i, (lat, lon) in enumerate(zip(stops.lats.tolist(), stops.lons.tolist())):
+        buckets.setdefault(_grid_cell(lat, lon), []).append(i)
+    return {cell: np.asarray(ix, dtype=np.int64) for cell, ix in buckets.items()}
+
+
+def _grid_candidates(grid: Dict[Tuple[int, int], np.ndarray], min_lat: float, max_lat: float,
+                     min_lon: float, max_lon: float) -> Optional[np.ndarray]:
+    """Sorted indices of the stops in the grid cells overlapping a box, None if a full scan is cheaper."""
+    # nan/inf or absurd inputs cannot be mapped to grid cells
+    if not all(-360.0 <= v <= 360.0 for v in (min_lat, max_lat, min_lon, max_lon)):
+        return None
+    (lat0, lon0), (lat1, lon1) = _grid_cell(min_lat, min_lon), _grid_cell(max_lat, max_lon)
+    if (lat1 - lat0 + 1) * (lon1 - lon0 + 1) > len(grid):
+        return None
+    parts = []
+    for i in range(lat0, lat1 + 1):
+        for j in range(lon0, lon1 + 1):
+            cell_ix = grid.get((i, j))
+            if cell_ix is not None:
+                parts.append(cell_ix)
+    # Sorted, so stops at equal distances keep the same (rowid) order as a full scan
+    return np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+
+def _fetch_candidate_stops(db_path: str, start_lat: float, start_lon: float,
+                           radius_m: float) -> List[Tuple[int, float]]:
+    stops = _load_stop_arrays(db_path)
+    # Half the Earth's circumference already covers every stop; larger radii would overflow below
+    radius_m = min(radius_m, math.pi * EARTH_RADIUS_M)
+    # Only stops in the grid cells overlapping the bounding box of the search circle get their
+    # distance computed
+    min_lat, max_lat, min_lon, max_lon = bounding_box(start_lat, start_lon, radius_m)
+    ix = _grid_candidates(_load_stop_grid(db_path), min_lat, max_lat, min_lon, max_lon)
+    if ix is None:
+        # The circle covers more cells than hold stops, or the inputs are out of range:
+        # a bounding box mask over all stops (nan compares false, so it matches nothing)
+        ix = np.flatnonzero(
+            (stops.lats >= min_lat) & (stops.lats <= max_lat) & (stops.lons >= min_lon) & (stops.lons <= max_lon)
+        )
+
+    # The squared equirectangular distances only prefilter: the 1% margin covers their error at city
+    # scale, and the exact great-circle distance of the stops that pass decides
+    dist_sq = _vector_equirect_sq(start_lat, start_lon, stops.lat_rad[ix], stops.lon_rad[ix])
+    ix = ix[dist_sq <= (radius_m * 1.01 / EARTH_RADIUS_M) ** 2]
+    dist = haversine_distance_m_batch_rad(math.radians(start_lat), math.radians(start_lon),
+                                          stops.lat_rad[ix], stops.lon_rad[ix], stops.cos_lat[ix])
+    within = dist <= radius_m
+    ix, dist = ix[within], dist[within]
+    order = np.argsort(dist, kind="stable")
+
+    # (stop index, distance_m) pairs, nearest first; the stop's fields are only read for
+    # departures that make it into the response
+    return list(zip(ix[order].tolist(), dist[order].tolist()))
+
+
+# Candidate stops are queried in batches: one statement per batch, while the nearest stops
+# usually fill the requested limit without touching the rest
+_STOP_BATCH_SIZE = 8
+
+# (stop_times rowid, trip_id, arrival_sec, departure_sec)
+Departure = Tuple[int, str, int, int]
+
 
-    # Next stop
+def _fetch_stop_departures(cur, stop_ids: List[Any], window_start: int,
+                           window_end: int) -> List[Tuple[int, Departure]]:
+    """Departures per stop as (position in stop_ids, departure): all of them in [window_start, window_end),
+    then up to three more from window_end on.
+
+    That covers the next three departures for any start time inside the window. Rows come back in
+    stop_ids order, then departure order, so callers consume them as they are.
+    """
+    values = ", ".join(["(?, ?)"] * len(stop_ids))
+    params: List[Any] = []
+    for pos, stop_id in enumerate(stop_ids):
+        params += (pos, stop_id)
+    params += (window_start, window_end, window_end)
     cur.execute(
-        """SELECT st.stop_id, s.stop_lat, s.stop_lon
-               FROM stop_times st
-               JOIN stops s ON s.stop_id = st.stop_id
-               WHERE st.trip_id = ? AND st.stop_sequence > ?
-               ORDER BY st.stop_sequence ASC
-               LIMIT 1""",
-        (trip_id, seq),
+        f"""WITH candidates(pos, stop_id) AS (VALUES {values})
+            SELECT c.pos,
+                   st.rowid,
+                   st.trip_id,
+                   st.arrival_sec,
+                   st.departure_sec
+            FROM candidates c
+            JOIN stop_times st ON st.rowid IN (
+                SELECT st1.rowid
+                FROM stop_times st1
+                WHERE st1.stop_id = c.stop_id
+                  AND st1.departure_sec >= ?
+                  AND st1.departure_sec < ?
+                UNION ALL
+                SELECT * FROM (
+                    SELECT st2.rowid
+                    FROM stop_times st2
+                    WHERE st2.stop_id = c.stop_id
+                      AND st2.departure_sec >= ?
+                    ORDER BY st2.departure_sec ASC
+                    LIMIT 3))
+            ORDER BY c.pos ASC, st.departure_sec ASC""",
+        params,
     )
-    next_row = cur.fetchone()
-    if not next_row:
-        return True
+    return [(pos, (rowid, trip_id, arrival_sec, departure_sec))
+            for pos, rowid, trip_id, arrival_sec, departure_sec in cur]
+
+
+def _iter_candidate_departures(conn, stop_ids: List[Any], candidate_stops: List[Tuple[int, float]],
+                               window_start: int, window_end: int):
+    """Yield one batch at a time, nearest stop first, as (stop index, distance_m, departures) per stop
+    with departures."""
+    cur = conn.cursor()
+    for offset in range(0, len(candidate_stops), _STOP_BATCH_SIZE):
+        batch = candidate_stops[offset:offset + _STOP_BATCH_SIZE]
+        groups: List[Tuple[int, float, List[Departure]]] = []
+        prev_pos = None
+        for pos, departure in _fetch_stop_departures(cur, [stop_ids[ix] for ix, _ in batch],
+                                                     window_start, window_end):
+            if pos != prev_pos:
+                ix, distance_m = batch[pos]
+                groups.append((ix, distance_m, []))
+                prev_pos = pos
+            groups[-1][2].append(departure)
+        yield groups
+
+
+# Start times are rounded down to this many seconds before looking up the results cache
+_TIME_BUCKET_SEC = 30
+
+# Larger queries skip the results cache: an entry holds every departure fetched for its query,
+# and its size grows with the limit and the radius
+_CACHE_MAX_LIMIT = 20
+_CACHE_MAX_RADIUS_M = 2000
+
+# Departures of one stop, in departure order: (departure_sec, arrival_sec, trip_id, kept), where kept is
+# False for departures the trip and direction filters drop
+StopDepartures = List[Tuple[int, int, str, bool]]
+
+# (stop index, distance_m, departures)
+CandidateStop = Tuple[int, float, StopDepartures]
 
-    current_to_dest = haversine_distance_m(current_lat, current_lon, dest_lat, dest_lon)
-    next_to_dest = haversine_distance_m(float(next_row["stop_lat"]), float(next_row["stop_lon"]), dest_lat, dest_lon)
-    return next_to_dest <= current_to_dest
+
+def _select_departures(candidates: List[CandidateStop], time_sec: int,
+                       limit: int) -> List[Tuple[int, float, str, int, int]]:
+    """Up to limit kept departures among the next three at or after time_sec of each stop, nearest stop first.
+
+    Returns (stop index, distance_m, trip_id, arrival_sec, departure_sec) tuples.
+    """
+    selected: List[Tuple[int, float, str, int, int]] = []
+    if limit <= 0:
+        return selected
+    for stop_ix, distance_m, departures in candidates:
+        taken = 0
+        for departure_sec, arrival_sec, trip_id, kept in departures:
+            if departure_sec < time_sec:
+                continue
+            if taken == 3:
+                break
+            taken += 1
+            if kept:
+                selected.append((stop_ix, distance_m, trip_id, arrival_sec, departure_sec))
+                if len(selected) >= limit:
+                    return selected
+    return selected
 
 
 def query_closest_departures(city: str,
@@ -80,83 +360,143 @@ def query_closest_departures(city: str,
                              start_time_iso: str,
                              limit: int,
                              radius_m: float) -> List[Dict[str, Any]]:
-    conn = get_connection()
+    """Departures near start heading towards dest."""
+    # Parse the start time once; every departure is formatted against its date
+    start_dt = parse_iso_datetime(start_time_iso)
+    start_day = start_dt.date()
+    time_sec = start_dt.hour * 3600 + start_dt.minute * 60 + start_dt.second
+    db_path = _current_db_path()
+
+    # Quantize the cache key (~1 m, 30 s, whole meters of radius) so repeated queries, e.g. from polling
+    # clients, hit the cache; the cached departures cover the whole 30 s bucket and are cut at the exact
+    # start time here
+    radius_m = round(radius_m)
+    if limit <= _CACHE_MAX_LIMIT and radius_m <= _CACHE_MAX_RADIUS_M:
+        find_departures = _closest_departures
+    else:
+        find_departures = _closest_departures.__wrapped__
+    candidates = find_departures(
+        db_path,
+        (round(start[0], 5), round(start[1], 5)),
+        (round(dest[0], 5), round(dest[1], 5)),
+        time_sec - time_sec % _TIME_BUCKET_SEC,
+        limit,
+        radius_m,
+    )
+
+    stops = _load_stop_arrays(db_path)
+    trip_meta = _load_trip_meta(db_path)
+    results: List[Dict[str, Any]] = []
+    for stop_ix, distance_m, trip_id, arrival_sec, departure_sec in _select_departures(candidates, time_sec, limit):
+        route_id, trip_headsign = trip_meta[trip_id]
+        results.append({
+            "trip_id": trip_id,
+            "route_id": route_id,
+            "trip_headsign": trip_headsign,
+            "stop": {
+                "name": stops.names[stop_ix],
+                "coordinates": {
+                    "latitude": float(stops.lats[stop_ix]),
+                    "longitude": float(stops.lons[stop_ix]),
+                },
+                "arrival_time": combine_day_and_seconds(start_day, arrival_sec),
+                "departure_time": combine_day_and_seconds(start_day, departure_sec),
+                "walking_distance_m": round(distance_m, 1),
+            },
+        })
+    return results
+
+
+@functools.lru_cache(maxsize=2048)
+def _closest_departures(db_path: str,
+                        start: Tuple[float, float],
+                        dest: Tuple[float, float],
+                        bucket_sec: int,
+                        limit: int,
+                        radius_m: int) -> List[CandidateStop]:
+    """Departures of the nearest stops, enough to answer any start time in [bucket_sec, bucket_sec + _TIME_BUCKET_SEC)."""
+    conn = get_connection(db_path)
+    trip_meta = _load_trip_meta(db_path)
+    stops = _load_stop_arrays(db_path)
+    next_stop = _load_next_stop_index(db_path)
     start_lat, start_lon = start
     dest_lat, dest_lon = dest
+    bucket_end = bucket_sec + _TIME_BUCKET_SEC
 
-    time_part = extract_time_part_iso(start_time_iso).strftime("%H:%M:%S")
+    candidate_stops = _fetch_candidate_stops(db_path, start_lat, start_lon, radius_m)
+    # The direction filter below only compares distances to the destination: squared
+    # equirectangular distances in degrees are enough, with the cos taken once per query
+    cos_dest = math.cos(math.radians(dest_lat))
 
-    candidate_stops = _fetch_candidate_stops(conn, start_lat, start_lon, radius_m)
-    results: List[Dict[str, Any]] = []
-    cur = conn.cursor()
+    def to_dest_sq(ix):
+        x = (float(stops.lons[ix]) - dest_lon) * cos_dest
+        y = float(stops.lats[ix]) - dest_lat
+        return x * x + y * y
+
+    candidates: List[CandidateStop] = []
+    # What gets selected only changes for start times just after a departure inside the bucket
+    start_times = {bucket_sec}
+    for groups in _iter_candidate_departures(conn, stops.stop_ids, candidate_stops, bucket_sec, bucket_end):
+        for stop_ix, distance_m, departures in groups:
+            stop_dist_sq = to_dest_sq(stop_ix)
+            stop_departures: StopDepartures = []
+            for rowid, trip_id, arrival_sec, departure_sec in departures:
+                if departure_sec < bucket_end:
+                    start_times.add(departure_sec + 1)
+                # Approximate direction filter: if the next stop in the trip is farther from the
+                # destination than the current stop, the trip goes the wrong way
+                next_ix = next_stop[rowid]
+                kept = trip_id in trip_meta and not (next_ix >= 0 and to_dest_sq(next_ix) > stop_dist_sq)
+                stop_departures.append((departure_sec, arrival_sec, trip_id, kept))
+            candidates.append((stop_ix, distance_m, stop_departures))
 
-    for stop in candidate_stops:
-        if len(results) >= limit:
+        # Stop querying once the nearest stops fill the limit for every start time in the bucket
+        if all(len(_select_departures(candidates, t, limit)) >= limit for t in start_times if t < bucket_end):
             break
 
-        cur.execute(
-            """SELECT st.trip_id,
-                          st.arrival_time,
-                          st.departure_time,
-                          st.stop_id,
-                          st.stop_sequence,
-                          t.route_id,
-                          t.trip_headsign
-                   FROM stop_times st
-                   JOIN trips t ON t.trip_id = st.trip_id
-                   WHERE st.stop_id = ?
-                     AND st.departure_time >= ?
-                   ORDER BY st.departure_time ASC
-                   LIMIT 3""",
-            (stop["stop_id"], time_part),
-        )
-        rows = cur.fetchall()
-        for row in rows:
-            if len(results) >= limit:
-                break
+    return candidates
 
-            # Direction filter
-            if not _is_trip_towards_destination(
-                conn,
-                row["trip_id"],
-                row["stop_id"],
-                stop["latitude"],
-                stop["longitude"],
-                dest_lat,
-                dest_lon,
-            ):
-                continue
 
-            arrival_iso = combine_date_and_hms(start_time_iso, row["arrival_time"])
-            departure_iso = combine_date_and_hms(start_time_iso, row["departure_time"])
-
-            results.append({
-                "trip_id": row["trip_id"],
-                "route_id": row["route_id"],
-                "trip_headsign": row["trip_headsign"],
-                "stop": {
-                    "name": stop["name"],
-                    "coordinates": {
-                        "latitude": stop["latitude"],
-                        "longitude": stop["longitude"],
-                    },
-                    "arrival_time": arrival_iso,
-                    "departure_time": departure_iso,
-                    "walking_distance_m": round(stop["distance_m"], 1),
+def get_trip_details(city: str, trip_id: str) -> Optional[Dict[str, Any]]:
+    """Trip with its stops in sequence order, or None."""
+    trip = _trip_details(_current_db_path(), trip_id)
+    if trip is None:
+        return None
+    route_id, trip_headsign, stop_rows = trip
+
+    # Built per call from the cached tuples, so callers may modify the result
+    return {
+        "trip_id": trip_id,
+        "route_id": route_id,
+        "trip_headsign": trip_headsign,
+        "stops": [
+            {
+                "name": stop_name,
+                "coordinates": {
+                    "latitude": stop_lat,
+                    "longitude": stop_lon,
                 },
-            })
+                "arrival_time": arrival_time,
+                "departure_time": departure_time,
+            }
+            for stop_name, stop_lat, stop_lon, arrival_time, departure_time in stop_rows
+        ],
+    }
 
-    return results
 
+# (stop_name, stop_lat, stop_lon, arrival_time, departure_time)
+TripStop = Tuple[str, float, float, str, str]
 
-def get_trip_details(city: str, trip_id: str) -> Optional[Dict[str, Any]]:
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT trip_id, route_id, trip_headsign FROM trips WHERE trip_id = ?", (trip_id,))
-    trip_row = cur.fetchone()
-    if not trip_row:
+
+@functools.lru_cache(maxsize=4096)
+def _trip_details(db_path: str, trip_id: str) -> Optional[Tuple[str, str, Tuple[TripStop, ...]]]:
+    """(route_id, trip_headsign, stops in sequence order) of a trip, or None."""
+    trip = _load_trip_meta(db_path).get(trip_id)
+    if trip is None:
         return None
+    route_id, trip_headsign = trip
 
+    cur = get_connection(db_path).cursor()
     cur.execute(
         """SELECT s.stop_name,
                       s.stop_lat,
@@ -169,22 +509,6 @@ def get_trip_details(city: str, trip_id: str) -> Optional[Dict[str, Any]]:
                ORDER BY st.stop_sequence ASC""",
         (trip_id,),
     )
-    stops = []
-    rows = cur.fetchall()
-    for row in rows:
-        stops.append({
-            "name": row["stop_name"],
-            "coordinates": {
-                "latitude": float(row["stop_lat"]),
-                "longitude": float(row["stop_lon"]),
-            },
-            "arrival_time": row["arrival_time"],
-            "departure_time": row["departure_time"],
-        })
-
-    return {
-        "trip_id": trip_row["trip_id"],
-        "route_id": trip_row["route_id"],
-        "trip_headsign": trip_row["trip_headsign"],
-        "stops": stops,
-    }
+    stop_rows = tuple((stop_name, float(stop_lat), float(stop_lon), arrival_time, departure_time)
+                      for stop_name, stop_lat, stop_lon, arrival_time, departure_time in cur)
+    return route_id, trip_headsign, stop_rows
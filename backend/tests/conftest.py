@@ -29,12 +29,14 @@ CREATE TABLE IF NOT EXISTS stop_times (
     departure_time TEXT NOT NULL,     -- HH:MM:SS
     stop_id TEXT NOT NULL,
     stop_sequence INTEGER NOT NULL,
+    arrival_sec INTEGER NOT NULL,     -- arrival_time as seconds after midnight
+    departure_sec INTEGER NOT NULL,   -- departure_time as seconds after midnight
     FOREIGN KEY (trip_id) REFERENCES trips(trip_id),
     FOREIGN KEY (stop_id) REFERENCES stops(stop_id)
 );
 
 CREATE INDEX IF NOT EXISTS idx_stop_times_trip ON stop_times(trip_id);
-CREATE INDEX IF NOT EXISTS idx_stop_times_stop ON stop_times(stop_id);
+CREATE INDEX IF NOT EXISTS idx_stop_times_stop_dep ON stop_times(stop_id, departure_sec);
 """
 
 def seed_demo_data(conn):
@@ -63,30 +65,33 @@ def seed_demo_data(conn):
     # Simplified: times on same day; your app converts to ISO when building response.
     stop_times = [
         # TRIP_002 across two central stops
-        ("TRIP_002", "08:35:00", "08:37:00", "WR-1001", 1),
-        ("TRIP_002", "08:39:00", "08:40:00", "WR-2001", 2),
+        ("TRIP_002", "08:35:00", "08:37:00", "WR-1001", 1, 30900, 31020),
+        ("TRIP_002", "08:39:00", "08:40:00", "WR-2001", 2, 31140, 31200),
         # TRIP_031 at Arkady
-        ("TRIP_031", "08:37:00", "08:39:00", "WR-1002", 1),
+        ("TRIP_031", "08:37:00", "08:39:00", "WR-1002", 1, 31020, 31140),
         # TRIP_X at Dworzec Główny
-        ("TRIP_X", "08:41:00", "08:42:00", "WR-1001", 1),
+        ("TRIP_X", "08:41:00", "08:42:00", "WR-1001", 1, 31260, 31320),
     ]
     cur.executemany(
-        """INSERT INTO stop_times(trip_id, arrival_time, departure_time, stop_id, stop_sequence)
-           VALUES (?,?,?,?,?)""",
+        """INSERT INTO stop_times(trip_id, arrival_time, departure_time, stop_id, stop_sequence,
+                                  arrival_sec, departure_sec)
+           VALUES (?,?,?,?,?,?,?)""",
         stop_times,
     )
     conn.commit()
 
+# Shared-cache in-memory database: lives as long as one connection to it stays open
+TEST_DB_URI = "file:wroclaw_test?mode=memory&cache=shared"
+
 @pytest.fixture(scope="session")
-def test_db_path(tmp_path_factory):
-    db_path = tmp_path_factory.mktemp("db") / "wroclaw_gtfs.sqlite"
-    conn = sqlite3.connect(db_path)
+def test_db_path():
+    keeper = sqlite3.connect(TEST_DB_URI, uri=True)
     try:
-        conn.executescript(DB_TABLES_SQL)
-        seed_demo_data(conn)
+        keeper.executescript(DB_TABLES_SQL)
+        seed_demo_data(keeper)
+        yield TEST_DB_URI
     finally:
-        conn.close()
-    return str(db_path)
+        keeper.close()
 
 @pytest.fixture(scope="session")
 def app(test_db_path, monkeypatch):
@@ -1,75 +1,87 @@
+import math
 import os
 import sqlite3
-import tempfile
+import threading
 from datetime import datetime, timezone
 
 import pytest
 
 # Ensure we import the local package correctly
 from backend.app import app as flask_app
+from backend import db, utils
 from backend.db import DEFAULT_DB_PATH
 
 
-@pytest.fixture(scope="module")
-def test_db_path():
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".sqlite")
-    tmp.close()
-    conn = sqlite3.connect(tmp.name)
-    cur = conn.cursor()
+# Shared-cache in-memory database: lives as long as one connection to it stays open
+TEST_DB_URI = "file:test_api?mode=memory&cache=shared"
 
-    # Minimal schema for tests
-    cur.executescript(
-        """            CREATE TABLE stops (
-            stop_id TEXT PRIMARY KEY,
-            stop_name TEXT,
-            stop_lat REAL,
-            stop_lon REAL
-        );
-        CREATE TABLE trips (
-            trip_id TEXT PRIMARY KEY,
-            route_id TEXT,
-            trip_headsign TEXT
-        );
-        CREATE TABLE stop_times (
-            trip_id TEXT,
-            arrival_time TEXT,
-            departure_time TEXT,
-            stop_id TEXT,
-            stop_sequence INTEGER
-        );
-        """
-    )
+# Minimal schema for tests
+TEST_TABLES_SQL = """
+CREATE TABLE stops (
+    stop_id TEXT PRIMARY KEY,
+    stop_name TEXT,
+    stop_lat REAL,
+    stop_lon REAL
+);
+CREATE TABLE trips (
+    trip_id TEXT PRIMARY KEY,
+    route_id TEXT,
+    trip_headsign TEXT
+);
+CREATE TABLE stop_times (
+    trip_id TEXT,
+    arrival_time TEXT,
+    departure_time TEXT,
+    stop_id TEXT,
+    stop_sequence INTEGER,
+    arrival_sec INTEGER,
+    departure_sec INTEGER
+);
+"""
 
-    # Test data: simple two-stop trip
-    cur.execute(
-        "INSERT INTO stops(stop_id, stop_name, stop_lat, stop_lon) VALUES (?,?,?,?)",
-        ("STOP_A", "Stop A", 51.1079, 17.0385),
-    )
-    cur.execute(
+
+def seed_test_data(conn):
+    cur = conn.cursor()
+    cur.executemany(
         "INSERT INTO stops(stop_id, stop_name, stop_lat, stop_lon) VALUES (?,?,?,?)",
-        ("STOP_B", "Stop B", 51.11, 17.05),
+        [
+            ("STOP_A", "Stop A", 51.1079, 17.0385),
+            ("STOP_B", "Stop B", 51.11, 17.05),
+        ],
     )
-
-    cur.execute(
+    cur.executemany(
         "INSERT INTO trips(trip_id, route_id, trip_headsign) VALUES (?,?,?)",
-        ("TRIP_1", "A", "To B"),
+        [
+            ("TRIP_1", "A", "To B"),
+            ("TRIP_NIGHT", "N", "To B"),
+        ],
     )
-
-    cur.execute(
-        "INSERT INTO stop_times(trip_id, arrival_time, departure_time, stop_id, stop_sequence) VALUES (?,?,?,?,?)",
-        ("TRIP_1", "08:00:00", "08:01:00", "STOP_A", 1),
+    cur.executemany(
+        "INSERT INTO stop_times(trip_id, arrival_time, departure_time, stop_id, stop_sequence, arrival_sec, departure_sec) "
+        "VALUES (?,?,?,?,?,?,?)",
+        [
+            # Simple two-stop trip
+            ("TRIP_1", "08:00:00", "08:01:00", "STOP_A", 1, 28800, 28860),
+            ("TRIP_1", "08:10:00", "08:11:00", "STOP_B", 2, 29400, 29460),
+            # Night trip with GTFS times past midnight
+            ("TRIP_NIGHT", "24:05:00", "24:06:00", "STOP_A", 1, 86700, 86760),
+            ("TRIP_NIGHT", "24:15:00", "24:16:00", "STOP_B", 2, 87300, 87360),
+        ],
     )
-    cur.execute(
-        "INSERT INTO stop_times(trip_id, arrival_time, departure_time, stop_id, stop_sequence) VALUES (?,?,?,?,?)",
-        ("TRIP_1", "08:10:00", "08:11:00", "STOP_B", 2),
-    )
-
     conn.commit()
-    conn.close()
+
+
+@pytest.fixture(scope="session")
+def test_db_path():
+    # Built once per test session; tests only read from it
+    conn = sqlite3.connect(TEST_DB_URI, uri=True)
+    conn.executescript(TEST_TABLES_SQL)
+    seed_test_data(conn)
 
     # Point the backend to this DB
-    os.environ["GTFS_DB_PATH"] = tmp.name
-    return tmp.name
+    os.environ["GTFS_DB_PATH"] = TEST_DB_URI
+    yield TEST_DB_URI
+    conn.close()
 
 
 @pytest.fixture()
@@ -107,6 +119,99 @@ def test_closest_departures_basic(client):
     assert dep["stop"]["name"] == "Stop A"
 
 
+def test_closest_departures_past_midnight(client):
+    resp = client.get(
+        "/public_transport/city/Wroclaw/closest_departures",
+        query_string={
+            "start_coordinates": "51.1079,17.0385",
+            "end_coordinates": "51.11,17.05",
+            "start_time": "2025-04-02T23:50:00Z",
+            "limit": 1,
+            "radius_m": 1000,
+        },
+    )
+    assert resp.status_code == 200
+    dep = resp.json["departures"][0]
+    assert dep["trip_id"] == "TRIP_NIGHT"
+    assert dep["stop"]["departure_time"] == "2025-04-03T00:06:00Z"
+
+
+def test_closest_departures_exact_start_time(client):
+    def departures(start_time):
+        resp = client.get(
+            "/public_transport/city/Wroclaw/closest_departures",
+            query_string={
+                "start_coordinates": "51.1079,17.0385",
+                "end_coordinates": "51.11,17.05",
+                "start_time": start_time,
+                "limit": 5,
+                "radius_m": 1000,
+            },
+        )
+        assert resp.status_code == 200
+        return [(dep["trip_id"], dep["stop"]["departure_time"]) for dep in resp.json["departures"]]
+
+    # Both start times fall in the same cache bucket; TRIP_1 leaves Stop A at 08:01:00
+    assert ("TRIP_1", "2025-04-02T08:01:00Z") in departures("2025-04-02T08:01:00Z")
+    later = departures("2025-04-02T08:01:10Z")
+    assert ("TRIP_1", "2025-04-02T08:01:00Z") not in later
+    assert all(departure_time >= "2025-04-02T08:01:10Z" for _, departure_time in later)
+    assert ("TRIP_1", "2025-04-02T08:11:00Z") in later
+
+
+@pytest.mark.parametrize(
+    "start_coordinates, radius_m",
+    [
+        ("nan,17.0385", "1000"),
+        ("51.1079,inf", "1000"),
+        ("51.1079,17.0385", "nan"),
+        ("51.1079,17.0385", "inf"),
+        ("51.1079,17.0385", "-inf"),
+    ],
+)
+def test_closest_departures_rejects_non_finite_input(client, start_coordinates, radius_m):
+    resp = client.get(
+        "/public_transport/city/Wroclaw/closest_departures",
+        query_string={
+            "start_coordinates": start_coordinates,
+            "end_coordinates": "51.11,17.05",
+            "start_time": "2025-04-02T07:59:00Z",
+            "radius_m": radius_m,
+        },
+    )
+    assert resp.status_code == 400
+
+
+@pytest.mark.parametrize("limit", ["0", "-1", "101", "100000000000000000000"])
+def test_closest_departures_rejects_out_of_range_limit(client, limit):
+    resp = client.get(
+        "/public_transport/city/Wroclaw/closest_departures",
+        query_string={
+            "start_coordinates": "51.1079,17.0385",
+            "end_coordinates": "51.11,17.05",
+            "start_time": "2025-04-02T07:59:00Z",
+            "limit": limit,
+        },
+    )
+    assert resp.status_code == 400
+    assert "limit" in resp.json["error"]
+
+
+@pytest.mark.parametrize(
+    "lat, lon, radius_m, expected",
+    [
+        (float("nan"), 17.0385, 1000, 0),
+        (51.1079, 17.0385, float("nan"), 0),
+        (1e307, 17.0385, 1000, 0),
+        (51.1079, 17.0385, float("inf"), 2),
+        (51.1079, 17.0385, 1e308, 2),
+    ],
+)
+def test_candidate_stops_out_of_range_input(test_db_path, lat, lon, radius_m, expected):
+    # Inputs the grid cannot index fall back to a full scan instead of raising
+    assert len(db._fetch_candidate_stops(test_db_path, lat, lon, radius_m)) == expected
+
+
 def test_trip_details(client):
     resp = client.get("/public_transport/city/Wroclaw/trip/TRIP_1")
     assert resp.status_code == 200
@@ -115,3 +220,262 @@ def test_trip_details(client):
     assert details["trip_id"] == "TRIP_1"
     assert len(details["stops"]) == 2
     assert details["stops"][0]["name"] == "Stop A"
+
+
+def test_trip_details_not_shared(test_db_path):
+    details = db.get_trip_details("Wroclaw", "TRIP_1")
+    details["stops"].clear()
+    details["trip_headsign"] = "changed"
+
+    again = db.get_trip_details("Wroclaw", "TRIP_1")
+    assert again["trip_headsign"] == "To B"
+    assert [stop["name"] for stop in again["stops"]] == ["Stop A", "Stop B"]
+
+
+def test_get_connection_reused_within_thread(test_db_path):
+    assert db.get_connection(test_db_path) is db.get_connection(test_db_path)
+
+
+def test_get_connection_per_thread(test_db_path):
+    other = []
+    thread = threading.Thread(target=lambda: other.append(db.get_connection(test_db_path)))
+    thread.start()
+    thread.join()
+    assert other[0] is not db.get_connection(test_db_path)
+
+
+def test_get_connection_is_read_only(test_db_path):
+    conn = db.get_connection(test_db_path)
+    # PRAGMA query_only: writes fail even though the database itself is writable
+    with pytest.raises(sqlite3.OperationalError, match="readonly"):
+        conn.execute("DELETE FROM stops")
+    assert conn.execute("SELECT count(*) FROM stops").fetchone() == (2,)
+
+
+@pytest.fixture()
+def file_db_path(tmp_path, monkeypatch):
+    # A database file, so the caches can see it being rewritten
+    db_path = str(tmp_path / "gtfs.sqlite")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(TEST_TABLES_SQL)
+    seed_test_data(conn)
+    conn.close()
+    monkeypatch.setenv("GTFS_DB_PATH", db_path)
+    yield db_path
+    db.clear_caches()
+
+
+def rename_headsign(db_path, headsign):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute("UPDATE trips SET trip_headsign = ? WHERE trip_id = 'TRIP_1'", (headsign,))
+    conn.close()
+
+
+def test_caches_follow_rewritten_database(file_db_path):
+    assert db.get_trip_details("Wroclaw", "TRIP_1")["trip_headsign"] == "To B"
+
+    rename_headsign(file_db_path, "Re-imported")
+    # Make sure the rewrite shows in the file's mtime even on filesystems with coarse timestamps
+    st = os.stat(file_db_path)
+    os.utime(file_db_path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    assert db.get_trip_details("Wroclaw", "TRIP_1")["trip_headsign"] == "Re-imported"
+
+
+def test_clear_caches(file_db_path):
+    assert db.get_trip_details("Wroclaw", "TRIP_1")["trip_headsign"] == "To B"
+
+    # A rewrite the file's identity does not reveal keeps serving the cached data...
+    st = os.stat(file_db_path)
+    rename_headsign(file_db_path, "Re-imported")
+    os.utime(file_db_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert db.get_trip_details("Wroclaw", "TRIP_1")["trip_headsign"] == "To B"
+
+    # ...until the caches are cleared explicitly
+    db.clear_caches()
+    assert db.get_trip_details("Wroclaw", "TRIP_1")["trip_headsign"] == "Re-imported"
+
+
+# A street running east from LINE_ORIGIN, with stops every 100 m and one either side of the 1 km mark;
+# it crosses the grid cell boundary at longitude 17.0
+LINE_DB_URI = "file:test_api_line?mode=memory&cache=shared"
+LINE_ORIGIN = (51.105, 16.995)
+LINE_EAST = (51.105, 17.2)
+LINE_WEST = (51.105, 16.9)
+
+
+def east_of_origin(distance_m):
+    lat, lon = LINE_ORIGIN
+    return lat, lon + math.degrees(distance_m / (utils.EARTH_RADIUS_M * math.cos(math.radians(lat))))
+
+
+def seed_line_data(conn):
+    stops = [(f"P{i}", 100 * i) for i in range(1, 10)] + [
+        ("EDGE_IN", 995), ("EDGE_OUT", 1005), ("FAR_EAST", 5000), ("FAR_WEST", -2000)]
+    conn.executemany(
+        "INSERT INTO stops(stop_id, stop_name, stop_lat, stop_lon) VALUES (?,?,?,?)",
+        [(stop_id, stop_id, *east_of_origin(distance_m)) for stop_id, distance_m in stops],
+    )
+    # Stops without departures in cells of their own, so a 1 km search uses the grid, not a full scan
+    conn.executemany(
+        "INSERT INTO stops(stop_id, stop_name, stop_lat, stop_lon) VALUES (?,?,?,?)",
+        [(f"OTHER{k}", f"OTHER{k}", 51.3, 16.8 + 0.02 * k) for k in range(20)],
+    )
+
+    # (trip_id, first stop, departure_sec there, next stop): the nearer the stop, the later its trip
+    # leaves, so results ordered by time would differ from results ordered by distance
+    trips = [(f"T_P{i}", f"P{i}", 29400 - 60 * i, "FAR_EAST") for i in range(1, 10)] + [
+        ("T_P1_LATER", "P1", 29700, "FAR_EAST"),
+        ("T_EDGE_IN", "EDGE_IN", 28800, "FAR_EAST"),
+        ("T_EDGE_OUT", "EDGE_OUT", 28800, "FAR_EAST"),
+        ("WEST", "P1", 28830, "FAR_WEST"),
+    ]
+    conn.executemany(
+        "INSERT INTO trips(trip_id, route_id, trip_headsign) VALUES (?,?,?)",
+        [(trip_id, "L", next_stop) for trip_id, _, _, next_stop in trips],
+    )
+    stop_times = []
+    for trip_id, stop_id, departure_sec, next_stop in trips:
+        stop_times.append((trip_id, stop_id, 1, departure_sec))
+        stop_times.append((trip_id, next_stop, 2, departure_sec + 600))
+    conn.executemany(
+        "INSERT INTO stop_times(trip_id, stop_id, stop_sequence, arrival_sec, departure_sec) VALUES (?,?,?,?,?)",
+        [(trip_id, stop_id, seq, sec, sec) for trip_id, stop_id, seq, sec in stop_times],
+    )
+    conn.commit()
+
+
+@pytest.fixture(scope="session")
+def line_db():
+    conn = sqlite3.connect(LINE_DB_URI, uri=True)
+    conn.executescript(TEST_TABLES_SQL)
+    seed_line_data(conn)
+    yield LINE_DB_URI
+    conn.close()
+
+
+@pytest.fixture()
+def line_db_path(line_db, monkeypatch):
+    monkeypatch.setenv("GTFS_DB_PATH", line_db)
+    return line_db
+
+
+def line_departures(dest, limit=20, start_time="2025-04-02T07:59:00Z"):
+    departures = db.query_closest_departures("Wroclaw", LINE_ORIGIN, dest, start_time, limit, 1000)
+    return [(dep["trip_id"], dep["stop"]["name"]) for dep in departures]
+
+
+def test_candidate_stops_radius_edge(line_db_path):
+    assert db._grid_candidates(db._load_stop_grid(line_db_path),
+                               *utils.bounding_box(*LINE_ORIGIN, 1000)) is not None
+    candidates = db._fetch_candidate_stops(line_db_path, *LINE_ORIGIN, 1000)
+    names = [db._load_stop_arrays(line_db_path).names[ix] for ix, _ in candidates]
+    # Nearest first, across the grid cell boundary, up to but not past the radius
+    assert names == [f"P{i}" for i in range(1, 10)] + ["EDGE_IN"]
+    assert [round(distance_m) for _, distance_m in candidates] == [100 * i for i in range(1, 10)] + [995]
+
+
+def destination(lat, lon, bearing_deg, distance_m):
+    """The point distance_m away along a great circle, on the sphere the backend measures on."""
+    phi1, lambda1, theta = math.radians(lat), math.radians(lon), math.radians(bearing_deg)
+    delta = distance_m / utils.EARTH_RADIUS_M
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(theta))
+    lambda2 = lambda1 + math.atan2(math.sin(theta) * math.sin(delta) * math.cos(phi1),
+                                   math.cos(delta) - math.sin(phi1) * math.sin(phi2))
+    return math.degrees(phi2), math.degrees(lambda2)
+
+
+@pytest.fixture(scope="session")
+def ring_db():
+    # Stops all around LINE_ORIGIN just inside and just outside 3 km, where the equirectangular
+    # approximation is off by more than the gap
+    conn = sqlite3.connect("file:test_api_ring?mode=memory&cache=shared", uri=True)
+    conn.executescript(TEST_TABLES_SQL)
+    conn.executemany(
+        "INSERT INTO stops(stop_id, stop_name, stop_lat, stop_lon) VALUES (?,?,?,?)",
+        [(f"{side}{bearing}", side, *destination(*LINE_ORIGIN, bearing, distance_m))
+         for bearing in range(0, 360, 15) for side, distance_m in (("IN", 2999.7), ("OUT", 3000.3))],
+    )
+    conn.commit()
+    yield "file:test_api_ring?mode=memory&cache=shared"
+    conn.close()
+
+
+def test_candidate_stops_exact_radius(ring_db):
+    candidates = db._fetch_candidate_stops(ring_db, *LINE_ORIGIN, 3000)
+    names = db._load_stop_arrays(ring_db).names
+    assert {names[ix] for ix, _ in candidates} == {"IN"}
+    assert len(candidates) == 24
+    assert all(distance_m <= 3000 for _, distance_m in candidates)
+
+
+def test_closest_departures_ordered_by_stop_distance(line_db_path):
+    # Ten stops: more than one _STOP_BATCH_SIZE batch of the VALUES query
+    assert line_departures(LINE_EAST) == (
+        [("T_P1", "P1"), ("T_P1_LATER", "P1")]
+        + [(f"T_P{i}", f"P{i}") for i in range(2, 10)]
+        + [("T_EDGE_IN", "EDGE_IN")]
+    )
+
+
+def test_closest_departures_direction_filter(line_db_path):
+    # WEST leaves P1 first, but its next stop is farther from an eastern destination
+    assert "WEST" not in [trip_id for trip_id, _ in line_departures(LINE_EAST)]
+    # Heading west, it is the only trip going the right way
+    assert line_departures(LINE_WEST) == [("WEST", "P1")]
+
+
+def test_closest_departures_cache_bounds(line_db_path):
+    db._closest_departures.cache_clear()
+
+    # Radii are quantized to whole meters
+    for radius_m in (999.6, 1000, 1000.4):
+        db.query_closest_departures("Wroclaw", LINE_ORIGIN, LINE_EAST, "2025-04-02T07:59:00Z", 5, radius_m)
+    assert db._closest_departures.cache_info().currsize == 1
+
+    # Queries that could make a large entry are answered without the cache
+    big = db.query_closest_departures("Wroclaw", LINE_ORIGIN, LINE_EAST, "2025-04-02T07:59:00Z",
+                                      db._CACHE_MAX_LIMIT + 1, 1000)
+    db.query_closest_departures("Wroclaw", LINE_ORIGIN, LINE_EAST, "2025-04-02T07:59:00Z",
+                                5, db._CACHE_MAX_RADIUS_M + 1)
+    assert db._closest_departures.cache_info().currsize == 1
+    assert len(big) == 11
+
+
+def test_closest_departures_radius_capped(client, monkeypatch):
+    monkeypatch.setattr("backend.app.MAX_RADIUS_M", 500.0)
+    resp = client.get(
+        "/public_transport/city/Wroclaw/closest_departures",
+        query_string={
+            "start_coordinates": "51.1079,17.0385",
+            "end_coordinates": "51.11,17.05",
+            "start_time": "2025-04-02T07:59:00Z",
+            "radius_m": "1000000",
+        },
+    )
+    assert resp.status_code == 200
+    assert resp.json["metadata"]["query_parameters"]["radius_m"] == 500.0
+    # Stop B, ~830 m away, is outside the capped radius
+    assert {dep["stop"]["name"] for dep in resp.json["departures"]} == {"Stop A"}
+
+
+@pytest.mark.parametrize("limit", [0, -1])
+def test_closest_departures_non_positive_limit(line_db_path, limit):
+    assert line_departures(LINE_EAST, limit=limit) == []
+
+
+def test_closest_departures_cache(line_db_path):
+    db._closest_departures.cache_clear()
+
+    first = line_departures(LINE_EAST, limit=2)
+    assert db._closest_departures.cache_info().misses == 1
+    # Same 30 s bucket: served from the cache
+    assert line_departures(LINE_EAST, limit=2, start_time="2025-04-02T07:59:20Z") == first
+    assert db._closest_departures.cache_info().hits == 1
+
+    # The limit is part of the key
+    more = line_departures(LINE_EAST, limit=3)
+    assert db._closest_departures.cache_info().misses == 2
+    assert first == [("T_P1", "P1"), ("T_P1_LATER", "P1")]
+    assert more == first + [("T_P2", "P2")]
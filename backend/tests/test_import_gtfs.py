@@ -0,0 +1,140 @@
+import importlib.util
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from backend import db
+
+# data/ is a scripts folder, not a package: load the importer from its path
+IMPORTER_PATH = Path(__file__).resolve().parents[2] / "data" / "import_gtfs.py"
+_spec = importlib.util.spec_from_file_location("import_gtfs", IMPORTER_PATH)
+import_gtfs = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(import_gtfs)
+
+
+def write_csv(path: Path, text: str) -> Path:
+    # GTFS exports often start with a BOM
+    path.write_text("\ufeff" + text, encoding="utf-8")
+    return path
+
+
+@pytest.fixture()
+def conn():
+    conn = sqlite3.connect(":memory:")
+    yield conn
+    conn.close()
+
+
+def column_types(conn, table):
+    return {name: ctype for _, name, ctype, *_ in conn.execute(f'PRAGMA table_info("{table}")')}
+
+
+def test_import_infers_column_types(conn, tmp_path):
+    csv_path = write_csv(
+        tmp_path / "stop_times.txt",
+        "trip_id,arrival_time,stop_sequence,shape_dist,pickup_type\n"
+        "T1,08:00:00,1,0.5,0\n"
+        "T1,08:10:00,2,1.25,\n",
+    )
+    import_gtfs.import_csv_to_table(conn, "stop_times", csv_path)
+
+    assert column_types(conn, "stop_times") == {
+        "trip_id": "TEXT",
+        "arrival_time": "TEXT",
+        "stop_sequence": "INTEGER",
+        "shape_dist": "REAL",
+        # An empty value keeps the column TEXT
+        "pickup_type": "TEXT",
+    }
+    rows = conn.execute("SELECT stop_sequence, shape_dist FROM stop_times ORDER BY rowid").fetchall()
+    assert rows == [(1, 0.5), (2, 1.25)]
+
+    # The TEXT staging table is gone after the typed copy
+    tables = {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert tables == {"stop_times"}
+
+
+def test_import_keeps_identifiers_as_text(conn, tmp_path):
+    csv_path = write_csv(
+        tmp_path / "stops.txt",
+        "stop_id,stop_code,stop_name,stop_lat,stop_lon\n"
+        "0042,007,Rynek,51.1090,17.0326\n"
+        "123,20332,Arkady,51.0999,17.0289\n",
+    )
+    import_gtfs.import_csv_to_table(conn, "stops", csv_path)
+
+    types = column_types(conn, "stops")
+    assert types["stop_id"] == "TEXT"
+    assert types["stop_code"] == "TEXT"
+    assert types["stop_lat"] == "REAL"
+    rows = conn.execute("SELECT stop_id, stop_code FROM stops ORDER BY rowid").fetchall()
+    assert rows == [("0042", "007"), ("123", "20332")]
+
+
+def test_import_treats_underscore_values_as_text(conn, tmp_path):
+    # int("3_15915566") succeeds in Python, but SQLite would keep it as a string anyway
+    csv_path = write_csv(tmp_path / "blocks.txt", "block,count\n3_15915566,1_000\n")
+    import_gtfs.import_csv_to_table(conn, "blocks", csv_path)
+
+    assert column_types(conn, "blocks") == {"block": "TEXT", "count": "TEXT"}
+    assert conn.execute("SELECT block, count FROM blocks").fetchone() == ("3_15915566", "1_000")
+
+
+def test_import_pads_short_rows(conn, tmp_path):
+    csv_path = write_csv(tmp_path / "trips.txt", "route_id,trip_id,trip_headsign\nA,T1\n")
+    import_gtfs.import_csv_to_table(conn, "trips", csv_path)
+
+    assert conn.execute("SELECT route_id, trip_id, trip_headsign FROM trips").fetchone() == ("A", "T1", "")
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("08:01:30", 28890), ("6:05:00", 21900), ("25:10:00", 90600), ("", None), (None, None)],
+)
+def test_gtfs_time_to_seconds(value, expected):
+    assert import_gtfs.gtfs_time_to_seconds(value) == expected
+
+
+def test_add_time_seconds_columns(conn, tmp_path):
+    csv_path = write_csv(
+        tmp_path / "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "T1,23:59:00,24:01:00,S1,1\n"
+        "T1,,,S2,2\n",
+    )
+    import_gtfs.import_csv_to_table(conn, "stop_times", csv_path)
+    import_gtfs.add_time_seconds_columns(conn)
+
+    rows = conn.execute("SELECT arrival_sec, departure_sec FROM stop_times ORDER BY rowid").fetchall()
+    assert rows == [(86340, 86460), (None, None)]
+
+
+def test_imported_numeric_looking_trip_id_is_found(tmp_path, monkeypatch):
+    raw_dir = tmp_path / "raw"
+    raw_dir.mkdir()
+    write_csv(raw_dir / "trips.txt", "route_id,service_id,trip_id,trip_headsign\n10,3,123,Krzyki\n")
+    write_csv(
+        raw_dir / "stops.txt",
+        "stop_id,stop_code,stop_name,stop_lat,stop_lon\n"
+        "0042,1,Rynek,51.1090,17.0326\n"
+        "0043,2,Arkady,51.0999,17.0289\n",
+    )
+    write_csv(
+        raw_dir / "stop_times.txt",
+        "trip_id,arrival_time,departure_time,stop_id,stop_sequence\n"
+        "123,08:00:00,08:01:00,0042,2\n"
+        "123,08:10:00,08:11:00,0043,10\n",
+    )
+    db_path = tmp_path / "gtfs.sqlite"
+    monkeypatch.setattr(import_gtfs, "RAW_DIR", raw_dir)
+    monkeypatch.setattr(import_gtfs, "DB_PATH", db_path)
+    import_gtfs.main()
+
+    monkeypatch.setenv("GTFS_DB_PATH", str(db_path))
+    details = db.get_trip_details("Wroclaw", "123")
+    assert details is not None
+    assert details["trip_id"] == "123"
+    assert details["route_id"] == "10"
+    # stop_sequence is numeric, so 10 sorts after 2
+    assert [stop["name"] for stop in details["stops"]] == ["Rynek", "Arkady"]
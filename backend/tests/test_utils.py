@@ -0,0 +1,59 @@
+import math
+from datetime import date, datetime, timezone
+
+import numpy as np
+import pytest
+
+from backend import utils
+
+
+def test_haversine_distance_m_one_degree_of_latitude():
+    assert utils.haversine_distance_m(51.0, 17.0, 52.0, 17.0) == pytest.approx(
+        math.radians(1.0) * utils.EARTH_RADIUS_M)
+    assert utils.haversine_distance_m(51.1079, 17.0385, 51.1079, 17.0385) == 0.0
+
+
+@pytest.fixture(params=["numpy", "numba"])
+def haversine_backend(request, monkeypatch):
+    if request.param == "numpy":
+        # Force the NumPy version even where numba is installed
+        monkeypatch.setattr(utils, "_haversine_batch_nb", None)
+    else:
+        pytest.importorskip("numba")
+        assert utils._haversine_batch_nb is not None
+    return request.param
+
+
+def test_haversine_batch_matches_scalar(haversine_backend):
+    rng = np.random.default_rng(0)
+    lats = 51.1 + rng.uniform(-0.1, 0.1, 200)
+    lons = 17.03 + rng.uniform(-0.2, 0.2, 200)
+
+    batch = utils.haversine_distance_m_batch(51.1079, 17.0385, lats, lons)
+
+    expected = [utils.haversine_distance_m(51.1079, 17.0385, lat, lon) for lat, lon in zip(lats, lons)]
+    np.testing.assert_allclose(batch, expected, rtol=1e-9, atol=1e-6)
+
+
+def test_bounding_box_encloses_circle():
+    min_lat, max_lat, min_lon, max_lon = utils.bounding_box(51.1079, 17.0385, 1000)
+    # The box edges are more than radius_m away, so the whole circle fits inside
+    assert utils.haversine_distance_m(51.1079, 17.0385, max_lat, 17.0385) > 1000
+    assert utils.haversine_distance_m(51.1079, 17.0385, 51.1079, max_lon) > 1000
+    assert min_lat < 51.1079 < max_lat and min_lon < 17.0385 < max_lon
+
+
+def test_parse_iso_datetime_accepts_z():
+    assert utils.parse_iso_datetime("2025-04-02T08:30:00Z") == datetime(2025, 4, 2, 8, 30, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize(
+    "seconds, expected",
+    [
+        (28860, "2025-04-02T08:01:00Z"),
+        (86760, "2025-04-03T00:06:00Z"),
+        (2 * 86400 + 5, "2025-04-04T00:00:05Z"),
+    ],
+)
+def test_combine_day_and_seconds(seconds, expected):
+    assert utils.combine_day_and_seconds(date(2025, 4, 2), seconds) == expected
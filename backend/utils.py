@@ -1,5 +1,13 @@
+import functools
 import math
-from datetime import datetime, time, timezone
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:  # optional, the NumPy version is used without it
+    njit = None
 
 EARTH_RADIUS_M = 6371000.0
 
@@ -16,6 +24,57 @@ def haversine_distance_m(lat1, lon1, lat2, lon2):
     return EARTH_RADIUS_M * c
 
 
+def _haversine_batch_np(phi1, lambda1, phis, lambdas, cos_phis):
+    d_phi = phis - phi1
+    d_lambda = lambdas - lambda1
+    a = np.sin(d_phi * 0.5) ** 2 + math.cos(phi1) * cos_phis * np.sin(d_lambda * 0.5) ** 2
+    # arcsin form: same result as 2 * atan2(sqrt(a), sqrt(1 - a)) without the second sqrt
+    return EARTH_RADIUS_M * 2.0 * np.arcsin(np.sqrt(a))
+
+
+if njit is not None:
+    @njit(cache=True, fastmath=True)
+    def _haversine_batch_nb(phi1, lambda1, phis, lambdas, cos_phis):
+        # One fused loop instead of a temporary array per NumPy operation
+        out = np.empty(phis.shape[0])
+        cos_phi1 = math.cos(phi1)
+        for i in range(phis.shape[0]):
+            s_phi = math.sin((phis[i] - phi1) * 0.5)
+            s_lambda = math.sin((lambdas[i] - lambda1) * 0.5)
+            a = s_phi * s_phi + cos_phi1 * cos_phis[i] * s_lambda * s_lambda
+            out[i] = EARTH_RADIUS_M * 2.0 * math.asin(math.sqrt(a))
+        return out
+else:
+    _haversine_batch_nb = None
+
+
+def haversine_distance_m_batch(lat1, lon1, lats, lons):
+    """Return distances in meters from one WGS84 coordinate to arrays of coordinates.
+
+    Uses a Numba-compiled loop when numba is installed, NumPy otherwise.
+    """
+    phis = np.radians(lats)
+    return haversine_distance_m_batch_rad(math.radians(lat1), math.radians(lon1), phis, np.radians(lons), np.cos(phis))
+
+
+def haversine_distance_m_batch_rad(phi1, lambda1, phis, lambdas, cos_phis):
+    """haversine_distance_m_batch for coordinates in radians, with cos(phis) precomputed by the caller."""
+    if _haversine_batch_nb is not None:
+        return _haversine_batch_nb(float(phi1), float(lambda1), np.asarray(phis, dtype=np.float64),
+                                   np.asarray(lambdas, dtype=np.float64), np.asarray(cos_phis, dtype=np.float64))
+    return _haversine_batch_np(phi1, lambda1, phis, lambdas, cos_phis)
+
+
+def bounding_box(lat, lon, radius_m):
+    """Return (min_lat, max_lat, min_lon, max_lon) of a box enclosing a circle of radius_m around a point."""
+    # Small margin so rounding never drops a stop lying right on the circle
+    d_lat = math.degrees(radius_m / EARTH_RADIUS_M) * 1.01
+    d_lon = d_lat / max(math.cos(math.radians(lat)), 1e-6)
+    return lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon
+
+
+# datetimes are immutable, so repeated start times (e.g. polling clients) can share one parse
+@functools.lru_cache(maxsize=128)
 def parse_iso_datetime(value: str) -> datetime:
     """Parse ISO 8601 date time. Supports trailing 'Z' as UTC."""
     if value is None:
@@ -26,19 +85,12 @@ def parse_iso_datetime(value: str) -> datetime:
     return datetime.fromisoformat(value)
 
 
-def extract_time_part_iso(value: str) -> time:
-    """Return only time component (HH:MM:SS) from an ISO 8601 datetime string."""
-    dt = parse_iso_datetime(value)
-    return dt.time().replace(microsecond=0)
-
-
-def combine_date_and_hms(base_iso: str, hms: str) -> str:
-    """Combine the date part of base_iso with an HH:MM:SS string, return ISO 8601 in UTC (Z)."""
-    base_dt = parse_iso_datetime(base_iso)
-    parts = hms.split(":")
-    if len(parts) != 3:
-        raise ValueError(f"Invalid time string: {hms}")
-    h, m, s = map(int, parts)
-    combined = base_dt.replace(hour=h, minute=m, second=s, microsecond=0)
+def combine_day_and_seconds(day: date, seconds: int) -> str:
+    """Combine a date with a GTFS time given as seconds after midnight, return ISO 8601 in UTC (Z)."""
+    days, seconds = divmod(seconds, 86400)
+    if days:
+        day += timedelta(days=days)
+    h, seconds = divmod(seconds, 3600)
+    m, s = divmod(seconds, 60)
     # Assume time is in UTC already; return with Z suffix
-    return combined.replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+    return f"{day.isoformat()}T{h:02d}:{m:02d}:{s:02d}Z"
@@ -2,7 +2,6 @@ import csv
 import os
 import sqlite3
 from pathlib import Path
-from typing import Dict, List
 
 DATA_DIR = Path(__file__).resolve().parent
 RAW_DIR = DATA_DIR / "raw"
@@ -11,7 +10,8 @@ DB_PATH = DATA_DIR / "gtfs.sqlite"
 
 def detect_type(value: str) -> str:
     value = value.strip()
-    if value == "":
+    # Python's int()/float() accept "1_000", SQLite does not: keep such ids as TEXT
+    if value == "" or "_" in value:
         return "TEXT"
     try:
         int(value)
@@ -32,45 +32,100 @@ def merge_types(type1: str, type2: str) -> str:
     return order[max(order.index(type1), order.index(type2))]
 
 
-def infer_schema(csv_path: Path) -> Dict[str, str]:
-    with csv_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.reader(f)
-        header = next(reader)
-        header = [h.strip().strip("\ufeff") for h in header]
-
-        # Initialize as TEXT by default
-        types = {name: "TEXT" for name in header}
-
-        for row in reader:
-            if not row:
-                continue
-            for name, value in zip(header, row):
-                t = detect_type(value)
-                types[name] = merge_types(types[name], t)
-    return types
+def is_identifier_column(name: str) -> bool:
+    """GTFS ids and codes (trip_id, stop_code, ...) are strings even when they look numeric."""
+    return name.endswith("_id") or name.endswith("_code")
 
 
 def import_csv_to_table(conn: sqlite3.Connection, table_name: str, csv_path: Path):
     print(f"Importing {csv_path.name} into table {table_name}")
-    schema = infer_schema(csv_path)
-    cols_def = ", ".join(f'"{col}" {ctype}' for col, ctype in schema.items())
-
     cur = conn.cursor()
     cur.execute(f'DROP TABLE IF EXISTS "{table_name}"')
-    cur.execute(f'CREATE TABLE "{table_name}" ({cols_def})')
 
     with csv_path.open("r", encoding="utf-8-sig", newline="") as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
+        reader = csv.reader(f)
+        header = next(reader)
+        col_names = [h.strip().strip("\ufeff") for h in header]
+        n_cols = len(col_names)
+
+        # The CSV is read once: rows are loaded as TEXT while the column types are inferred,
+        # starting from INTEGER and widening as values arrive. Identifiers stay TEXT, so leading
+        # zeros survive and lookups by the string ids from URLs keep matching
+        types = ["TEXT" if is_identifier_column(col) else "INTEGER" for col in col_names]
+        cols_def = ", ".join(f'"{col}" TEXT' for col in col_names)
+        cur.execute(f'CREATE TABLE "{table_name}" ({cols_def})')
+
+        def rows():
+            numeric = [i for i in range(n_cols) if types[i] != "TEXT"]
+            for row in reader:
+                if not row:
+                    continue
+                values = [value.strip() for value in row[:n_cols]]
+                if len(values) < n_cols:
+                    values += [""] * (n_cols - len(values))
+                if numeric:
+                    for i in numeric:
+                        value = values[i]
+                        # Plain digits cannot widen a numeric column, skip the full detect_type
+                        if not (value.isdigit() and value.isascii()):
+                            types[i] = merge_types(types[i], detect_type(value))
+                    numeric = [i for i in numeric if types[i] != "TEXT"]
+                yield values
+
+        placeholders = ", ".join(["?"] * n_cols)
+        insert_sql = f'INSERT INTO "{table_name}" ({", ".join(col_names)}) VALUES ({placeholders})'
+        cur.execute("BEGIN")
+        cur.executemany(insert_sql, rows())
+        n_rows = cur.rowcount
+
+    if n_rows > 0 and any(t != "TEXT" for t in types):
+        # Copy into a table with the inferred types; column affinity converts the TEXT values
+        staging = f"{table_name}__text"
+        cols_def = ", ".join(f'"{col}" {ctype}' for col, ctype in zip(col_names, types))
+        cur.execute(f'ALTER TABLE "{table_name}" RENAME TO "{staging}"')
+        cur.execute(f'CREATE TABLE "{table_name}" ({cols_def})')
+        cur.execute(f'INSERT INTO "{table_name}" SELECT * FROM "{staging}" ORDER BY rowid')
+        cur.execute(f'DROP TABLE "{staging}"')
+    conn.commit()
+
 
-    col_names = list(schema.keys())
-    placeholders = ", ".join(["?"] * len(col_names))
-    insert_sql = f'INSERT INTO "{table_name}" ({", ".join(col_names)}) VALUES ({placeholders})'
+def gtfs_time_to_seconds(value):
+    """Convert a GTFS H:MM:SS time (hours may exceed 23) to seconds after midnight, None if empty."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value == "":
+        return None
+    h, m, s = value.split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
 
-    for row in rows:
-        values = [row.get(col, "").strip() for col in col_names]
-        cur.execute(insert_sql, values)
 
+def add_time_seconds_columns(conn: sqlite3.Connection):
+    """Store stop_times arrival/departure as INTEGER seconds after midnight next to the text columns."""
+    print("Adding arrival_sec/departure_sec to stop_times")
+    conn.create_function("gtfs_time_to_seconds", 1, gtfs_time_to_seconds, deterministic=True)
+    cur = conn.cursor()
+    cur.execute("ALTER TABLE stop_times ADD COLUMN arrival_sec INTEGER")
+    cur.execute("ALTER TABLE stop_times ADD COLUMN departure_sec INTEGER")
+    cur.execute(
+        """UPDATE stop_times
+               SET arrival_sec = gtfs_time_to_seconds(arrival_time),
+                   departure_sec = gtfs_time_to_seconds(departure_time)"""
+    )
+    conn.commit()
+
+
+def create_indexes(conn: sqlite3.Connection):
+    """Index the lookups done by the backend and refresh the query planner statistics."""
+    print("Creating indexes")
+    cur = conn.cursor()
+    # Departures of a stop from a given time on, already in departure order
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_st_stop_dep ON stop_times(stop_id, departure_sec)")
+    # Stops of a trip in sequence order
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_st_trip_seq ON stop_times(trip_id, stop_sequence)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_trips_trip ON trips(trip_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stops_stop ON stops(stop_id)")
+    cur.execute("ANALYZE")
     conn.commit()
 
 
@@ -79,6 +134,11 @@ def main():
         raise SystemExit(f"Expected raw CSVs in {RAW_DIR}, but the folder does not exist.")
 
     conn = sqlite3.connect(DB_PATH.as_posix())
+    # The database is rebuilt from scratch on failure, so skip the rollback journal and fsyncs
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-200000")
 
     mapping = {
         "trips.txt": "trips",
@@ -86,12 +146,19 @@ def main():
         "stop_times.txt": "stop_times",
     }
 
+    imported = set()
     for csv_name, table_name in mapping.items():
         csv_path = RAW_DIR / csv_name
         if not csv_path.exists():
             print(f"WARNING: {csv_path} does not exist, skipping.")
             continue
         import_csv_to_table(conn, table_name, csv_path)
+        imported.add(table_name)
+
+    if "stop_times" in imported:
+        add_time_seconds_columns(conn)
+    if {"trips", "stops", "stop_times"} <= imported:
+        create_indexes(conn)
 
     conn.close()
     print(f"Database created at {DB_PATH}")